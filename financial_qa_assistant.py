@@ -1,18 +1,225 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import time
+import io
 import re
+import string
 import json
-from typing import Dict, List, Any
+from collections import deque
+from typing import Dict, List, Any, Optional
 
-# Import document processing libraries
+# Document processing libraries (PyMuPDF, pdfplumber, PyPDF2) are imported where
+# they are used, so app start-up does not pay for them before a file is uploaded
+
+# Number of chat messages kept in the session
+_MAX_CHAT_HISTORY = 50
+
+# Number of rows per sheet kept in the Excel text preview
+_EXCEL_PREVIEW_ROWS = 50
+
+# Processed uploads kept in the server-wide cache, and for how many seconds
+_PROCESSED_FILE_CACHE_ENTRIES = 8
+_PROCESSED_FILE_CACHE_TTL = 60 * 60
+
+# Optional: Hyperscan matches every metric pattern in a single pass over the text
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# Optional: pyahocorasick finds every financial term in a single pass over the text
 try:
-    import PyPDF2
-    from openpyxl import load_workbook
-    import pdfplumber
+    import ahocorasick
 except ImportError:
-    st.warning("Some required libraries are missing. Please install them using: pip install PyPDF2 openpyxl pdfplumber")
+    ahocorasick = None
+
+# Patterns to look for financial data with better context, compiled once at import.
+# The value is read from group 2, so only term-first patterns are listed: number-first
+# variants capture the term there and could never yield a value.
+# ASCII-only case folding agrees with Hyperscan and the term matcher.
+_METRIC_PATTERNS = {
+    'revenue': [
+        re.compile(r'(revenue|sales|income).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ],
+    'profit': [
+        re.compile(r'(profit|net income|net profit|earnings).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ],
+    'expenses': [
+        re.compile(r'(expenses|costs|operating expenses|cost of goods sold|cogs).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ],
+    'assets': [
+        re.compile(r'(total assets|assets).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ],
+    'liabilities': [
+        re.compile(r'(liabilities|debt|total liabilities).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ],
+    'equity': [
+        re.compile(r'(equity|shareholders equity|owners equity).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ],
+    'net income': [
+        re.compile(r'(net income|net profit|bottom line).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', re.IGNORECASE | re.ASCII)
+    ]
+}
+
+_NUMBER_RE = re.compile(r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)')
+
+# A whole captured value must look like a number; group 1 drops the dollar sign
+_VALIDATE_NUM = re.compile(r'^\$?(\d{1,3}(?:,\d{3})*(?:\.\d+)?)$')
+
+# Flattened (metric, pattern) list; the index doubles as the Hyperscan pattern id
+_PATTERN_LIST = [(metric, pattern) for metric, pattern_list in _METRIC_PATTERNS.items() for pattern in pattern_list]
+
+# Terms used to attribute numbers near them to a metric
+_FINANCIAL_TERMS = {
+    'revenue': ['revenue', 'sales', 'income', 'turnover'],
+    'profit': ['profit', 'net income', 'net profit', 'earnings'],
+    'expenses': ['expenses', 'costs', 'operating expenses', 'cogs', 'cost of goods sold'],
+    'assets': ['assets', 'total assets', 'current assets', 'fixed assets'],
+    'liabilities': ['liabilities', 'debt', 'total liabilities', 'current liabilities'],
+    'equity': ['equity', 'shareholders equity', 'owners equity'],
+    'net income': ['net income', 'net profit', 'bottom line']
+}
+
+# Inverted index: term -> bitmask of the metrics it belongs to, bit i being _METRIC_NAMES[i]
+_METRIC_NAMES = list(_FINANCIAL_TERMS)
+_TERM_METRIC_BITS = {}
+for _metric_id, _terms in enumerate(_FINANCIAL_TERMS.values()):
+    for _term in _terms:
+        _TERM_METRIC_BITS[_term] = _TERM_METRIC_BITS.get(_term, 0) | (1 << _metric_id)
+
+# Every metric the text extraction looks for
+_TARGET_METRICS = frozenset(_METRIC_NAMES)
+_ALL_METRIC_BITS = (1 << len(_METRIC_NAMES)) - 1
+
+# How many characters either side of a number count as its context
+_CONTEXT_WINDOW = 100
+
+# Scanning with the automaton lowercases the text one bounded chunk at a time
+_TERM_SCAN_CHUNK = 1 << 16
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def _build_term_matcher(terms):
+    """Build a function yielding (start, end, term) for every case-insensitive term occurrence in a text"""
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for term in terms:
+            automaton.add_word(term, term)
+        automaton.make_automaton()
+        overlap = max(len(term) for term in terms) - 1
+        
+        def find_terms(text):
+            # The automaton is case-sensitive; lowercase overlapping chunks rather than
+            # a copy of the whole text. ASCII-only lowering keeps offsets unchanged.
+            for chunk_start in range(0, len(text), _TERM_SCAN_CHUNK):
+                chunk_end = chunk_start + _TERM_SCAN_CHUNK
+                chunk = text[chunk_start:chunk_end + overlap].translate(_ASCII_LOWER)
+                for last, term in automaton.iter(chunk):
+                    start = chunk_start + last - len(term) + 1
+                    # Terms starting in the overlap are reported by the next chunk
+                    if start < chunk_end:
+                        yield start, start + len(term), term
+        return find_terms
+    
+    # Fallback: one alternation, the lookahead lets occurrences overlap
+    alternation = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    term_re = re.compile(f'(?=({alternation}))', re.IGNORECASE | re.ASCII)
+    
+    def find_terms(text):
+        for match in term_re.finditer(text):
+            yield match.start(1), match.end(1), match.group(1).lower()
+    return find_terms
+
+_find_financial_terms = _build_term_matcher(_TERM_METRIC_BITS)
+
+def _assign_numbers_to_metrics(term_starts, term_ends, term_metric_bits, number_starts, number_ends,
+                               text_length, assigned_bits, all_bits, window):
+    """Assign each number to the first unfilled metric with a term inside its context
+    
+    Term arrays must be sorted by start and number arrays by position. Returns the
+    metric id for each number, or -1 when it is not assigned.
+    """
+    assignments = np.full(len(number_starts), -1, dtype=np.int64)
+    first_hit = 0
+    for i in range(len(number_starts)):
+        # Stop once every metric has a value
+        if assigned_bits == all_bits:
+            break
+        
+        start_pos = max(0, number_starts[i] - window)
+        end_pos = min(text_length, number_ends[i] + window)
+        
+        # Numbers come in order, so terms before this window are never needed again
+        while first_hit < len(term_starts) and term_starts[first_hit] < start_pos:
+            first_hit += 1
+        
+        # Collect the metrics whose terms lie entirely within the context
+        nearby_bits = 0
+        hit = first_hit
+        while hit < len(term_starts) and term_starts[hit] < end_pos:
+            if term_ends[hit] <= end_pos:
+                nearby_bits |= term_metric_bits[hit]
+            hit += 1
+        
+        # Lowest unfilled metric wins, matching the metric order
+        candidates = nearby_bits & ~assigned_bits
+        if candidates:
+            metric_id = 0
+            while not (candidates >> metric_id) & 1:
+                metric_id += 1
+            assignments[i] = metric_id
+            assigned_bits |= 1 << metric_id
+    return assignments
+
+def _as_offsets(values: List[int]):
+    """Numba needs int64 arrays of offsets"""
+    return np.asarray(values, dtype=np.int64)
+
+@st.cache_resource(show_spinner=False)
+def _get_number_assigner():
+    """Return the number/term merge and the converter for its offset arguments
+    
+    Optional: Numba compiles the merge loop to machine code. It is imported on first
+    use, as importing it costs more at start-up than all the PDF libraries together.
+    Without Numba the plain Python loop is used on lists, which it indexes faster.
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return _assign_numbers_to_metrics, list
+    return njit(cache=True)(_assign_numbers_to_metrics), _as_offsets
+
+def _get_pages_text(doc) -> str:
+    """Extract the text of every page of an open PyMuPDF document"""
+    text_parts = []
+    for page in doc:
+        text = page.get_text("text")
+        if text:
+            text_parts.append(text)
+            text_parts.append("\n\n")
+    return "".join(text_parts)
+
+@st.cache_resource(show_spinner=False)
+def _build_hyperscan_database():
+    """Compile all metric patterns into one Hyperscan database
+    
+    Streamlit re-executes this script on every rerun, so the database is cached
+    for the lifetime of the server process instead of recompiled each time.
+    """
+    if hyperscan is None:
+        return None
+    try:
+        database = hyperscan.Database()
+        database.compile(
+            expressions=[pattern.pattern.encode('utf-8') for _, pattern in _PATTERN_LIST],
+            ids=list(range(len(_PATTERN_LIST))),
+            elements=len(_PATTERN_LIST),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(_PATTERN_LIST)
+        )
+        return database
+    except hyperscan.error:
+        return None
+
+_HYPERSCAN_DB = _build_hyperscan_database()
 
 # Set page configuration
 st.set_page_config(
@@ -22,8 +229,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for styling
-st.markdown("""
+# Custom CSS for styling, minified once here since it is sent to the browser on every rerun
+_CSS = """
 <style>
     .main-header {
         font-size: 3rem;
@@ -45,29 +252,6 @@ st.markdown("""
         margin: 1rem 0;
         border-radius: 0.25rem;
     }
-    .chat-container {
-        background-color: #f0f2f6;
-        border-radius: 0.5rem;
-        padding: 1.5rem;
-        height: 500px;
-        overflow-y: auto;
-    }
-    .user-message {
-        background-color: #d4edda;
-        padding: 0.75rem;
-        border-radius: 0.5rem;
-        margin: 0.5rem 0;
-        max-width: 80%;
-        margin-left: auto;
-    }
-    .assistant-message {
-        background-color: #ffffff;
-        padding: 0.75rem;
-        border-radius: 0.5rem;
-        margin: 0.5rem 0;
-        max-width: 80%;
-        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-    }
     .financial-data {
         background-color: #e9ecef;
         padding: 1rem;
@@ -86,7 +270,9 @@ st.markdown("""
         border-left: 4px solid #ffc107;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+_CSS = re.sub(r'\s*([{};:])\s*', r'\1', re.sub(r'\s+', ' ', _CSS)).strip()
+st.markdown(_CSS, unsafe_allow_html=True)
 
 class FinancialDocumentProcessor:
     """Process financial documents (PDF and Excel) and extract financial data"""
@@ -95,30 +281,34 @@ class FinancialDocumentProcessor:
         self.extracted_data = {}
         self.document_text = ""
         self.financial_metrics = {}
+        self._hyperscan_scratch = None
     
     def process_excel_file(self, file) -> Dict[str, Any]:
         """Process Excel financial documents"""
         try:
-            # Read the Excel file
-            df = pd.read_excel(file)
+            # Read the Excel file once and parse every sheet from the same handle
+            with pd.ExcelFile(file) as excel_file:
+                sheets = {sheet_name: excel_file.parse(sheet_name) for sheet_name in excel_file.sheet_names}
+                df = sheets[excel_file.sheet_names[0]]
             
             # Store the raw data
             self.extracted_data["excel_data"] = df.to_dict()
             
-            # Extract text content for LLM processing
-            text_content = ""
-            for sheet_name in pd.ExcelFile(file).sheet_names:
-                df_sheet = pd.read_excel(file, sheet_name=sheet_name)
-                text_content += f"Sheet: {sheet_name}\n"
-                text_content += df_sheet.to_string() + "\n\n"
+            # Extract a short text preview of each sheet for display
+            text_parts = []
+            for sheet_name, df_sheet in sheets.items():
+                text_parts.append(f"Sheet: {sheet_name}\n")
+                text_parts.append(df_sheet.head(_EXCEL_PREVIEW_ROWS).to_csv(index=False))
+                text_parts.append("\n\n")
+            text_content = "".join(text_parts)
             
             self.document_text = text_content
             
-            # Try to identify common financial statements
-            self._identify_financial_data(df)
-            
-            # Also extract from text content
-            self._extract_financial_metrics_from_text(text_content)
+            # Read metrics straight from the sheet data rather than from formatted text
+            for df_sheet in sheets.values():
+                # Try to identify common financial statements
+                self._identify_financial_data(df_sheet)
+                self._identify_financial_rows(df_sheet)
             
             return {
                 "success": True,
@@ -135,23 +325,35 @@ class FinancialDocumentProcessor:
     def process_pdf_file(self, file) -> Dict[str, Any]:
         """Process PDF financial documents"""
         try:
-            text_content = ""
-            
             # Try different PDF extraction methods
             try:
-                # Method 1: Using pdfplumber (better for text extraction)
-                with pdfplumber.open(file) as pdf:
-                    for page in pdf.pages:
+                # Method 1: Using PyMuPDF (fastest, MuPDF is written in C)
+                text_content = self._extract_text_with_pymupdf(file)
+            except:
+                # Collect page texts in a list and join once, instead of repeated +=
+                text_parts = []
+                file.seek(0)
+                try:
+                    # Method 2: Using pdfplumber (better for text extraction)
+                    import pdfplumber
+                    with pdfplumber.open(file) as pdf:
+                        for page in pdf.pages:
+                            text = page.extract_text()
+                            if text:
+                                text_parts.append(text)
+                                text_parts.append("\n\n")
+                except:
+                    # Method 3: Using PyPDF2 as fallback
+                    text_parts = []
+                    file.seek(0)
+                    import PyPDF2
+                    pdf_reader = PyPDF2.PdfReader(file)
+                    for page in pdf_reader.pages:
                         text = page.extract_text()
                         if text:
-                            text_content += text + "\n\n"
-            except:
-                # Method 2: Using PyPDF2 as fallback
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        text_content += text + "\n\n"
+                            text_parts.append(text)
+                            text_parts.append("\n\n")
+                text_content = "".join(text_parts)
             
             self.document_text = text_content
             
@@ -175,10 +377,21 @@ class FinancialDocumentProcessor:
                 "error": f"Error processing PDF file: {str(e)}"
             }
     
+    def _extract_text_with_pymupdf(self, file) -> str:
+        """Extract text from PDF using PyMuPDF"""
+        import fitz
+        
+        pdf_bytes = file.read()
+        file.seek(0)
+        
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return _get_pages_text(doc)
+    
     def _extract_tables_from_pdf(self, file) -> List[Any]:
         """Extract tables from PDF using pdfplumber"""
         tables = []
         try:
+            import pdfplumber
             with pdfplumber.open(file) as pdf:
                 for page in pdf.pages:
                     page_tables = page.extract_tables()
@@ -197,106 +410,163 @@ class FinancialDocumentProcessor:
             'cost', 'margin', 'gross', 'net', 'operating'
         ]
         
-        for col in df.columns:
-            if isinstance(col, str):
-                col_lower = col.lower()
-                for term in financial_terms:
-                    if term in col_lower:
-                        # Try to extract numerical values
-                        try:
-                            values = pd.to_numeric(df[col], errors='coerce').dropna()
-                            if not values.empty:
-                                # Get the last value (often the total)
-                                self.financial_metrics[col] = values.iloc[-1]
-                        except:
-                            pass
+        # Match every column name against all terms at once
+        term_pattern = '|'.join(financial_terms)
+        is_financial = pd.Index(df.columns).astype(str).str.contains(term_pattern, case=False, regex=True)
+        
+        # Extract numerical values from the matching columns in one pass
+        numeric = df.loc[:, np.asarray(is_financial, dtype=bool)].apply(pd.to_numeric, errors='coerce')
+        if numeric.empty:
+            return
+        
+        # Get the last value of each column (often the total)
+        last_values = numeric.ffill().iloc[-1].dropna()
+        self.financial_metrics.update({col: float(value) for col, value in last_values.items()})
+    
+    def _identify_financial_rows(self, df: pd.DataFrame) -> None:
+        """Identify financial data in row labels, e.g. a 'Revenue' row in a statement sheet"""
+        label_columns = df.select_dtypes(include='object')
+        if label_columns.empty:
+            return
+        labels = label_columns.iloc[:, 0].astype(str)
+        
+        # Convert the whole sheet to numbers in one pass; the last value in a row
+        # is usually the latest period
+        numeric = df.apply(pd.to_numeric, errors='coerce')
+        last_values = numeric.ffill(axis=1).iloc[:, -1]
+        
+        for metric, terms in _FINANCIAL_TERMS.items():
+            if metric in self.financial_metrics:
+                continue
+            term_pattern = '|'.join(re.escape(term) for term in terms)
+            matches = labels.str.contains(term_pattern, case=False, regex=True) & last_values.notna()
+            if matches.any():
+                self.financial_metrics[metric] = float(last_values[matches].iloc[0])
     
     def _extract_financial_metrics_from_text(self, text: str) -> None:
         """Extract financial metrics from text content with improved pattern matching"""
-        # Convert text to lowercase for easier matching
-        text_lower = text.lower()
-        
-        # Improved patterns to look for financial data with better context
-        patterns = {
-            'revenue': [
-                r'(revenue|sales|income).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(revenue|sales|income)'
-            ],
-            'profit': [
-                r'(profit|net income|net profit|earnings).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(profit|net income|net profit|earnings)'
-            ],
-            'expenses': [
-                r'(expenses|costs|operating expenses|cost of goods sold|cogs).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(expenses|costs|operating expenses)'
-            ],
-            'assets': [
-                r'(total assets|assets).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(total assets|assets)'
-            ],
-            'liabilities': [
-                r'(liabilities|debt|total liabilities).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(liabilities|debt)'
-            ],
-            'equity': [
-                r'(equity|shareholders equity|owners equity).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(equity|shareholders equity)'
-            ],
-            'net income': [
-                r'(net income|net profit|bottom line).*?[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',
-                r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?).*?(net income|net profit)'
-            ]
-        }
-        
         # Extract using patterns
-        for metric, pattern_list in patterns.items():
-            for pattern in pattern_list:
-                matches = re.findall(pattern, text_lower, re.IGNORECASE)
-                if matches:
-                    # Get the first match with a valid number
-                    for match in matches:
-                        if len(match) >= 2 and match[1].replace(',', '').replace('.', '').isdigit():
-                            value = match[1]
-                            # Clean the value
-                            if value.startswith('$'):
-                                value = value[1:]
-                            self.financial_metrics[metric] = value
-                            break
+        pattern_starts = self._scan_metric_patterns(text)
+        for pattern_id, (metric, pattern) in enumerate(_PATTERN_LIST):
+            if pattern_starts is None:
+                start = 0
+            elif pattern_id in pattern_starts:
+                start = pattern_starts[pattern_id]
+            else:
+                # Hyperscan found no match, skip the regex scan entirely
+                continue
+            
+            # Get the first match with a valid number
+            for match in pattern.finditer(text, start):
+                valid_number = _VALIDATE_NUM.match(match.group(2))
+                if valid_number:
+                    # Store the cleaned value as a number; formatting happens at display time
+                    self.financial_metrics[metric] = float(valid_number.group(1).replace(',', ''))
+                    break
+        
+        # Nothing left for the fallback when the patterns found every metric
+        if _TARGET_METRICS <= self.financial_metrics.keys():
+            return
         
         # Fallback: look for numbers near financial terms
-        financial_terms = {
-            'revenue': ['revenue', 'sales', 'income', 'turnover'],
-            'profit': ['profit', 'net income', 'net profit', 'earnings'],
-            'expenses': ['expenses', 'costs', 'operating expenses', 'cogs', 'cost of goods sold'],
-            'assets': ['assets', 'total assets', 'current assets', 'fixed assets'],
-            'liabilities': ['liabilities', 'debt', 'total liabilities', 'current liabilities'],
-            'equity': ['equity', 'shareholders equity', 'owners equity'],
-            'net income': ['net income', 'net profit', 'bottom line']
-        }
-        
-        # Find all numbers in the text
-        number_pattern = r'[\$]?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)'
-        numbers = re.findall(number_pattern, text)
-        
-        # For each number, check if it's near financial terms
-        for number in numbers:
-            # Get context around the number
-            number_pos = text_lower.find(number)
-            if number_pos == -1:
+        # Find every term once, sorted by position
+        term_hits = sorted(_find_financial_terms(text))
+        
+        # Find all valid numbers in the text
+        numbers = []
+        number_starts = []
+        number_ends = []
+        for number_match in _NUMBER_RE.finditer(text):
+            valid_number = _VALIDATE_NUM.match(number_match.group(1))
+            if valid_number:
+                # Clean the number
+                numbers.append(float(valid_number.group(1).replace(',', '')))
+                number_starts.append(number_match.start(1))
+                number_ends.append(number_match.end(1))
+        
+        assigned_bits = 0
+        for metric_id, metric in enumerate(_METRIC_NAMES):
+            if metric in self.financial_metrics:
+                assigned_bits |= 1 << metric_id
+        
+        # Match numbers to nearby terms on plain integer offsets
+        assign_numbers, as_offsets = _get_number_assigner()
+        assignments = assign_numbers(
+            as_offsets([start for start, _, _ in term_hits]),
+            as_offsets([end for _, end, _ in term_hits]),
+            as_offsets([_TERM_METRIC_BITS[term] for _, _, term in term_hits]),
+            as_offsets(number_starts),
+            as_offsets(number_ends),
+            len(text),
+            assigned_bits,
+            _ALL_METRIC_BITS,
+            _CONTEXT_WINDOW
+        )
+        for number, metric_id in zip(numbers, assignments):
+            if metric_id >= 0:
+                self.financial_metrics[_METRIC_NAMES[metric_id]] = number
+
+    def _scan_metric_patterns(self, text: str) -> Optional[Dict[int, int]]:
+        """Find where each metric pattern first matches using a single Hyperscan pass
+        
+        Returns None when Hyperscan is unavailable, otherwise a dict mapping pattern
+        ids to the offset the regex search should start from.
+        """
+        if _HYPERSCAN_DB is None:
+            return None
+        if self._hyperscan_scratch is None:
+            self._hyperscan_scratch = hyperscan.Scratch(_HYPERSCAN_DB)
+        
+        data = text.encode('utf-8')
+        first_ends = {}
+        
+        def on_match(pattern_id, start, end, flags, context):
+            first_ends[pattern_id] = end
+        
+        _HYPERSCAN_DB.scan(data, match_event_handler=on_match, scratch=self._hyperscan_scratch)
+        
+        # Metric patterns never span a newline, so the leftmost match of a pattern
+        # lies on the same line as the earliest match end Hyperscan reports
+        starts = {}
+        is_ascii = len(data) == len(text)
+        char_offset = byte_offset = 0
+        for pattern_id, end in sorted(first_ends.items(), key=lambda item: item[1]):
+            line_start = data.rfind(b'\n', 0, end) + 1
+            if is_ascii:
+                starts[pattern_id] = line_start
                 continue
-                
-            start_pos = max(0, number_pos - 100)
-            end_pos = min(len(text_lower), number_pos + len(number) + 100)
-            context = text_lower[start_pos:end_pos]
-            
-            # Check which financial term this number might belong to
-            for metric, terms in financial_terms.items():
-                if any(term in context for term in terms) and metric not in self.financial_metrics:
-                    # Clean the number
-                    clean_number = number.replace('$', '').replace(',', '')
-                    if clean_number.replace('.', '').isdigit():
-                        self.financial_metrics[metric] = number
-                        break
+            # Convert the byte offset back to a character offset; visiting the line
+            # starts in order decodes each part of the text only once
+            char_offset += len(data[byte_offset:line_start].decode('utf-8'))
+            byte_offset = line_start
+            starts[pattern_id] = char_offset
+        return starts
+
+# Question topics in order of precedence: trigger terms, metric keys to look up, response template
+_QUESTION_TOPICS = [
+    (['revenue', 'sales', 'income', 'turnover'], ('revenue', 'sales', 'income'),
+     "Based on the financial document, the {metric} is ${value:,.2f}."),
+    (['profit', 'net income', 'net profit', 'earnings', 'bottom line'], ('profit', 'net income', 'net profit', 'earnings'),
+     "The document shows a {metric} of ${value:,.2f}."),
+    (['expense', 'cost', 'spending', 'cogs'], ('expenses', 'costs', 'operating expenses'),
+     "Total {metric} are ${value:,.2f} according to the document."),
+    (['asset', 'property', 'equipment', 'inventory'], ('assets', 'total assets', 'current assets'),
+     "The document reports {metric} of ${value:,.2f}."),
+    (['liabilit', 'debt', 'payable', 'loan'], ('liabilities', 'debt', 'total liabilities'),
+     "The document shows {metric} of ${value:,.2f}."),
+    (['equity', 'shareholder', 'owner'], ('equity', 'shareholders equity'),
+     "According to the document, {metric} is ${value:,.2f}."),
+    (['net income', 'net profit'], ('net income', 'net profit'),
+     "The document shows {metric} of ${value:,.2f}.")
+]
+
+# Inverted index: trigger term -> first topic it belongs to
+_TRIGGER_TOPICS = {}
+for _topic_id, (_triggers, _, _) in enumerate(_QUESTION_TOPICS):
+    for _trigger in _triggers:
+        _TRIGGER_TOPICS.setdefault(_trigger, _topic_id)
+
+_find_question_triggers = _build_term_matcher(_TRIGGER_TOPICS)
 
 class FinancialQASystem:
     """Question-Answering system for financial documents"""
@@ -304,54 +574,78 @@ class FinancialQASystem:
     def __init__(self):
         self.conversation_history = []
     
-    def generate_response(self, question: str, document_text: str, financial_metrics: Dict[str, Any]) -> str:
+    def generate_response(self, question: str, document_text: str, financial_metrics: Dict[str, float]) -> str:
         """Generate a response to a financial question with better matching"""
         question_lower = question.lower()
         
-        # Check for specific financial queries with better matching
-        if any(term in question_lower for term in ['revenue', 'sales', 'income', 'turnover']):
-            for key in ['revenue', 'sales', 'income']:
-                if key in financial_metrics:
-                    return f"Based on the financial document, the {key.replace('_', ' ')} is ${financial_metrics[key]}."
-        
-        elif any(term in question_lower for term in ['profit', 'net income', 'net profit', 'earnings', 'bottom line']):
-            for key in ['profit', 'net income', 'net profit', 'earnings']:
-                if key in financial_metrics:
-                    return f"The document shows a {key.replace('_', ' ')} of ${financial_metrics[key]}."
-        
-        elif any(term in question_lower for term in ['expense', 'cost', 'spending', 'cogs']):
-            for key in ['expenses', 'costs', 'operating expenses']:
+        # Find every trigger term in one pass; the earliest topic takes precedence
+        topic_ids = [_TRIGGER_TOPICS[term] for _, _, term in _find_question_triggers(question_lower)]
+        if topic_ids:
+            _, keys, template = _QUESTION_TOPICS[min(topic_ids)]
+            for key in keys:
                 if key in financial_metrics:
-                    return f"Total {key.replace('_', ' ')} are ${financial_metrics[key]} according to the document."
-        
-        elif any(term in question_lower for term in ['asset', 'property', 'equipment', 'inventory']):
-            for key in ['assets', 'total assets', 'current assets']:
-                if key in financial_metrics:
-                    return f"The document reports {key.replace('_', ' ')} of ${financial_metrics[key]}."
-        
-        elif any(term in question_lower for term in ['liabilit', 'debt', 'payable', 'loan']):
-            for key in ['liabilities', 'debt', 'total liabilities']:
-                if key in financial_metrics:
-                    return f"The document shows {key.replace('_', ' ')} of ${financial_metrics[key]}."
-        
-        elif any(term in question_lower for term in ['equity', 'shareholder', 'owner']):
-            for key in ['equity', 'shareholders equity']:
-                if key in financial_metrics:
-                    return f"According to the document, {key.replace('_', ' ')} is ${financial_metrics[key]}."
-        
-        elif any(term in question_lower for term in ['net income', 'net profit']):
-            for key in ['net income', 'net profit']:
-                if key in financial_metrics:
-                    return f"The document shows {key.replace('_', ' ')} of ${financial_metrics[key]}."
+                    return template.format(metric=key.replace('_', ' '), value=financial_metrics[key])
         
         # Show available metrics if no specific match
         if financial_metrics:
-            metrics_list = "\n".join([f"• **{k}**: ${v}" for k, v in financial_metrics.items()])
+            metrics_list = "\n".join([f"• **{k}**: ${v:,.2f}" for k, v in financial_metrics.items()])
             return f"I found these financial metrics in the document:\n\n{metrics_list}\n\nYou can ask about any of these specific values."
         
         # Default response if no financial data is found
         return "I've analyzed the document but couldn't extract specific financial metrics. The document may use different terminology. You can ask me to look for specific terms or try uploading a different financial document."
 
+@st.cache_data(show_spinner=False, max_entries=_PROCESSED_FILE_CACHE_ENTRIES, ttl=_PROCESSED_FILE_CACHE_TTL)
+def process_uploaded_file(file_bytes: bytes, file_type: str) -> Dict[str, Any]:
+    """Process an uploaded document, cached on its contents"""
+    processor = FinancialDocumentProcessor()
+    
+    if file_type == "application/pdf":
+        return processor.process_pdf_file(io.BytesIO(file_bytes))
+    return processor.process_excel_file(io.BytesIO(file_bytes))
+
+def _format_chat_markdown(text: str) -> str:
+    """Format a chat message for st.markdown"""
+    # Escape dollar signs so amounts are not rendered as LaTeX, and preserve line breaks
+    return text.replace('$', '\\$').replace('\n', '  \n')
+
+@st.fragment
+def chat_panel():
+    """Q&A chat panel; as a fragment, chat interactions rerun only this function"""
+    # Chat history is drawn above the input, but filled in after handling a new question
+    history = st.container()
+    
+    # Input for new question
+    question = st.chat_input("Ask a question about the financial document, e.g. What was the revenue?")
+    if question:
+        # Add user question to chat history
+        st.session_state.chat_history.append({
+            "role": "user",
+            "markdown": _format_chat_markdown(question)
+        })
+        
+        # Generate response
+        with st.spinner("Analyzing document..."):
+            response = st.session_state.qa_system.generate_response(
+                question, 
+                st.session_state.document_text, 
+                st.session_state.financial_metrics
+            )
+        
+        # Add assistant response to chat history, formatted once here rather than on every rerun
+        st.session_state.chat_history.append({
+            "role": "assistant",
+            "markdown": _format_chat_markdown(response)
+        })
+    
+    # Display chat history
+    with history:
+        for message in st.session_state.chat_history:
+            with st.chat_message(message["role"]):
+                st.markdown(message["markdown"])
+    
+    # The callback runs before the fragment reruns, so no st.rerun() is needed
+    st.button("Clear Chat", on_click=st.session_state.chat_history.clear)
+
 def main():
     # Application header
     st.markdown('<h1 class="main-header">📊 Financial Document Q&A Assistant</h1>', unsafe_allow_html=True)
@@ -366,7 +660,8 @@ def main():
     if 'qa_system' not in st.session_state:
         st.session_state.qa_system = FinancialQASystem()
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+        # Only the most recent messages are kept and re-rendered on each rerun
+        st.session_state.chat_history = deque(maxlen=_MAX_CHAT_HISTORY)
     if 'show_debug' not in st.session_state:
         st.session_state.show_debug = False
     
@@ -393,13 +688,8 @@ def main():
             }
             st.write(file_details)
             
-            # Process document
-            processor = FinancialDocumentProcessor()
-            
-            if uploaded_file.type == "application/pdf":
-                result = processor.process_pdf_file(uploaded_file)
-            else:
-                result = processor.process_excel_file(uploaded_file)
+            # Process document (cached, so reruns from other widgets skip extraction)
+            result = process_uploaded_file(uploaded_file.getvalue(), uploaded_file.type)
             
             if result["success"]:
                 st.session_state.processed = True
@@ -411,7 +701,7 @@ def main():
                 if st.session_state.financial_metrics:
                     st.markdown("### 📈 Extracted Financial Metrics")
                     for metric, value in st.session_state.financial_metrics.items():
-                        st.write(f"**{metric.capitalize()}:** ${value}")
+                        st.write(f"**{metric.capitalize()}:** ${value:,.2f}")
             else:
                 st.error(f"Error processing document: {result['error']}")
     
@@ -433,7 +723,7 @@ def main():
             if st.session_state.financial_metrics:
                 st.write("**Detected Financial Metrics:**")
                 for metric, value in st.session_state.financial_metrics.items():
-                    st.write(f"- **{metric.capitalize()}:** ${value}")
+                    st.write(f"- **{metric.capitalize()}:** ${value:,.2f}")
             
             st.markdown('</div>', unsafe_allow_html=True)
             
@@ -460,59 +750,17 @@ def main():
         st.markdown('<div class="sub-header">💬 Financial Q&A</div>', unsafe_allow_html=True)
         
         if st.session_state.processed:
-            # Chat interface
-            st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-            
-            # Display chat history
-            for message in st.session_state.chat_history:
-                if message["role"] == "user":
-                    st.markdown(f'<div class="user-message">👤 {message["content"]}</div>', unsafe_allow_html=True)
-                else:
-                    # Preserve line breaks in assistant messages
-                    formatted_content = message["content"].replace('\n', '<br>')
-                    st.markdown(f'<div class="assistant-message">🤖 {formatted_content}</div>', unsafe_allow_html=True)
-            
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Input for new question
-            question = st.text_input("Ask a question about the financial document:", key="question_input", placeholder="e.g., What was the revenue?")
-            
-            col1, col2 = st.columns([3, 1])
-            with col1:
-                if st.button("Submit Question") and question:
-                    # Add user question to chat history
-                    st.session_state.chat_history.append({"role": "user", "content": question})
-                    
-                    # Generate response
-                    with st.spinner("Analyzing document..."):
-                        # Simulate processing time
-                        time.sleep(0.5)
-                        
-                        response = st.session_state.qa_system.generate_response(
-                            question, 
-                            st.session_state.document_text, 
-                            st.session_state.financial_metrics
-                        )
-                        
-                        # Add assistant response to chat history
-                        st.session_state.chat_history.append({"role": "assistant", "content": response})
-                    
-                    # Rerun to update the chat display
-                    st.rerun()
-            
-            with col2:
-                if st.button("Clear Chat"):
-                    st.session_state.chat_history = []
-                    st.rerun()
+            chat_panel()
         else:
             st.info("Please upload a financial document to enable the Q&A feature.")
             
             # Placeholder chat interface
-            st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-            st.markdown('<div class="assistant-message">🤖 Please upload a financial document to start asking questions.</div>', unsafe_allow_html=True)
-            st.markdown('<div class="assistant-message">🤖 I can help you analyze income statements, balance sheets, and cash flow statements.</div>', unsafe_allow_html=True)
-            st.markdown('<div class="assistant-message">🤖 Try asking about revenue, profits, expenses, assets, or other financial metrics.</div>', unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
+            with st.chat_message("assistant"):
+                st.markdown("Please upload a financial document to start asking questions.")
+            with st.chat_message("assistant"):
+                st.markdown("I can help you analyze income statements, balance sheets, and cash flow statements.")
+            with st.chat_message("assistant"):
+                st.markdown("Try asking about revenue, profits, expenses, assets, or other financial metrics.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file